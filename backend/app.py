@@ -4,6 +4,10 @@ from pydantic import BaseModel
 import os
 import json
 import time
+import asyncio
+import heapq
+import contextlib
+from collections import Counter, deque
 from dotenv import load_dotenv
 from functools import lru_cache
 from typing import List, Dict, Any
@@ -52,6 +56,25 @@ except Exception:
 # -----------------------------
 # Semantic embeddings
 # -----------------------------
+# Thread env vars must be set before torch/MKL initialize (first torch
+# import happens inside sentence_transformers below)
+os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 2) - 1)))
+os.environ.setdefault("MKL_NUM_THREADS", str(max(1, (os.cpu_count() or 2) - 1)))
+
+try:
+    import torch
+    # Containers often default to 1 intra-op thread; use the cores we have
+    torch.set_num_threads(max(1, (os.cpu_count() or 2) - 1))
+    try:
+        torch.set_num_interop_threads(2)
+    except Exception:
+        pass  # Raises if parallel work already started
+    torch.set_grad_enabled(False)  # Inference-only process, skip autograd bookkeeping
+    TORCH_AVAILABLE = True
+except Exception as e:
+    print(f"[DEBUG] torch not available: {e}")
+    TORCH_AVAILABLE = False
+
 try:
     from sentence_transformers import SentenceTransformer, util
     SENTENCE_TRANSFORMERS_AVAILABLE = True
@@ -59,26 +82,199 @@ except Exception as e:
     print(f"[DEBUG] sentence_transformers not available: {e}")
     SENTENCE_TRANSFORMERS_AVAILABLE = False
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception as e:
+    print(f"[DEBUG] numpy not available: {e}")
+    NUMPY_AVAILABLE = False
+
+try:
+    from embed_cache import EmbedCache, entry_id
+    EMBED_CACHE_AVAILABLE = NUMPY_AVAILABLE
+except Exception as e:
+    print(f"[DEBUG] embed_cache not available: {e}")
+    EMBED_CACHE_AVAILABLE = False
+
+try:
+    import hnswlib
+    HNSW_AVAILABLE = NUMPY_AVAILABLE
+except Exception as e:
+    print(f"[DEBUG] hnswlib not available: {e}")
+    HNSW_AVAILABLE = False
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except Exception as e:
+    print(f"[DEBUG] faiss not available: {e}")
+    FAISS_AVAILABLE = False
+
+try:
+    from semantic_cache import SemanticCache
+    SEMANTIC_CACHE_AVAILABLE = NUMPY_AVAILABLE
+except Exception as e:
+    print(f"[DEBUG] semantic_cache not available: {e}")
+    SEMANTIC_CACHE_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception as e:
+    print(f"[DEBUG] orjson not available: {e}")
+    ORJSON_AVAILABLE = False
+
+try:
+    import aiofiles
+    AIOFILES_AVAILABLE = True
+except Exception as e:
+    print(f"[DEBUG] aiofiles not available: {e}")
+    AIOFILES_AVAILABLE = False
+
+# Optional ONNX Runtime backend for the embedding model: 2.5-4x faster on
+# CPU than PyTorch eager mode. Pre-export the model once with:
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 \
+#       --task feature-extraction --optimize O3 backend/onnx_minilm/
+# (optionally quantize to int8 with optimum.onnxruntime.ORTQuantizer).
+ONNX_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_minilm")
+try:
+    import onnxruntime as ort
+    from transformers import AutoTokenizer
+    ONNX_AVAILABLE = NUMPY_AVAILABLE and os.path.isdir(ONNX_MODEL_DIR)
+except Exception as e:
+    print(f"[DEBUG] onnxruntime not available: {e}")
+    ONNX_AVAILABLE = False
+
+EMBEDDINGS_AVAILABLE = SENTENCE_TRANSFORMERS_AVAILABLE or ONNX_AVAILABLE
+
+SIM_THRESHOLD = 0.40  # Minimum cosine sim for a chunk to count as relevant
+
+class OnnxEncoder:
+    """
+    Drop-in replacement for SentenceTransformer.encode backed by an ONNX
+    export of all-MiniLM-L6-v2: tokenize -> session.run -> mean-pool ->
+    L2-normalize. Skips PyTorch's per-call Python dispatch overhead.
+    """
+
+    def __init__(self, model_dir: str):
+        model_path = os.path.join(model_dir, "model_quantized.onnx")
+        if not os.path.exists(model_path):
+            model_path = os.path.join(model_dir, "model.onnx")
+        self.session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True,
+               convert_to_tensor=False, show_progress_bar=False):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        pooled_batches = []
+        for i in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(
+                list(texts[i:i + batch_size]), padding=True, truncation=True,
+                max_length=256, return_tensors="np"
+            )
+            feed = {k: v for k, v in tokens.items() if k in self._input_names}
+            hidden = self.session.run(None, feed)[0]  # (B, T, 384)
+            mask = tokens["attention_mask"][:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled_batches.append(pooled)
+        vecs = np.concatenate(pooled_batches).astype(np.float32)
+        vecs /= np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-9)
+        if single:
+            vecs = vecs[0]
+        if convert_to_tensor and TORCH_AVAILABLE:
+            return torch.from_numpy(vecs)
+        return vecs
+
 @lru_cache()
 def get_embed_model():
+    if ONNX_AVAILABLE:
+        try:
+            print("[DEBUG] Loading ONNX embedding model...")
+            return OnnxEncoder(ONNX_MODEL_DIR)
+        except Exception as e:
+            print(f"[DEBUG] ONNX model load failed, falling back to PyTorch: {e}")
     if not SENTENCE_TRANSFORMERS_AVAILABLE:
         raise RuntimeError("sentence_transformers not installed")
     print("[DEBUG] Loading embedding model...")
-    return SentenceTransformer("all-MiniLM-L6-v2")
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    # Half precision on GPU halves bandwidth with negligible sim drift;
+    # CPU stays fp32 — x86 has no fast fp16 arithmetic path
+    if TORCH_AVAILABLE and torch.cuda.is_available():
+        model = model.half()
+        print("[DEBUG] Embedding model cast to fp16 (CUDA)")
+    return model
+
+def _inference_ctx():
+    # inference_mode also skips version-counter tracking that grad-disable leaves on
+    return torch.inference_mode() if TORCH_AVAILABLE else contextlib.nullcontext()
 
 def embed_text(text: str):
-    if not SENTENCE_TRANSFORMERS_AVAILABLE:
-        raise RuntimeError("sentence_transformers not installed")
+    if not EMBEDDINGS_AVAILABLE:
+        raise RuntimeError("no embedding backend installed")
     if text is None:
         text = ""
     model = get_embed_model()
-    return model.encode(text, convert_to_tensor=True)
+    with _inference_ctx():
+        return model.encode(text, convert_to_tensor=True)
+
+def encode_batch(texts):
+    """Batch-encode a list of texts to a (N, 384) numpy float32 matrix."""
+    if not EMBEDDINGS_AVAILABLE:
+        raise RuntimeError("no embedding backend installed")
+    model = get_embed_model()
+    with _inference_ctx():
+        return model.encode(
+            texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False
+        )
+
+# -----------------------------
+# HNSW ANN index over ALL memory embeddings (no sampling, sub-ms top-k)
+# -----------------------------
+_hnsw_index = None
+_hnsw_entries = []  # label -> memory entry
+_hnsw_ids = set()  # entry ids already indexed
+
+def _get_hnsw_index(mem):
+    """Incrementally index every memory entry's chunk vector (cosine HNSW)."""
+    global _hnsw_index
+    if _hnsw_index is None:
+        _hnsw_index = hnswlib.Index(space="cosine", dim=384)
+        _hnsw_index.init_index(max_elements=100000, ef_construction=100, M=16)
+        _hnsw_index.set_ef(64)
+    new = [m for m in mem
+           if entry_id(m.get("query", ""), m.get("answer", "")) not in _hnsw_ids]
+    if new:
+        # Vectors come from the persistent cache; only unseen entries embed
+        vecs = get_embed_cache().get_or_embed(new, encode_batch)
+        labels = list(range(len(_hnsw_entries), len(_hnsw_entries) + len(new)))
+        _hnsw_index.add_items(vecs, labels)
+        _hnsw_entries.extend(new)
+        for m in new:
+            _hnsw_ids.add(entry_id(m.get("query", ""), m.get("answer", "")))
+        print(f"[DEBUG] HNSW index: +{len(new)} entries, {len(_hnsw_entries)} total")
+    return _hnsw_index, _hnsw_entries
+
+@lru_cache()
+def get_embed_cache():
+    if not EMBED_CACHE_AVAILABLE:
+        raise RuntimeError("embed cache unavailable (numpy missing)")
+    return EmbedCache()
+
+@lru_cache()
+def get_semantic_cache():
+    if not SEMANTIC_CACHE_AVAILABLE:
+        raise RuntimeError("semantic cache unavailable (numpy missing)")
+    return SemanticCache()
 
 # -----------------------------
 # File paths
 # -----------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MEMORY_FILE = os.path.join(BASE_DIR, "memory.json")
+MEMORY_FILE = os.path.join(BASE_DIR, "memory.jsonl")
+LEGACY_MEMORY_FILE = os.path.join(BASE_DIR, "memory.json")  # Pre-JSONL full-list store
 GRAPH_FILE = os.path.join(BASE_DIR, "graph.json")
 USER_PROFILE_FILE = os.path.join(BASE_DIR, "user_profile.json")
 FINE_TUNE_FILE = os.path.join(BASE_DIR, "fine_tune_data.jsonl")
@@ -88,7 +284,22 @@ def ensure_file(path, blank):
         with open(path, "w", encoding="utf-8") as f:
             json.dump(blank, f)
 
-ensure_file(MEMORY_FILE, [])
+def _init_memory_file():
+    """Create memory.jsonl, converting a legacy memory.json list if present."""
+    if os.path.exists(MEMORY_FILE):
+        return
+    legacy = []
+    try:
+        if os.path.exists(LEGACY_MEMORY_FILE):
+            with open(LEGACY_MEMORY_FILE, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+    except Exception as e:
+        print(f"[DEBUG] Legacy memory migration failed: {e}")
+    with open(MEMORY_FILE, "w", encoding="utf-8") as f:
+        for m in (legacy if isinstance(legacy, list) else []):
+            f.write(json.dumps(m, ensure_ascii=False) + "\n")
+
+_init_memory_file()
 ensure_file(GRAPH_FILE, {})
 ensure_file(USER_PROFILE_FILE, {})
 
@@ -132,66 +343,247 @@ if GEMINI_AVAILABLE and os.getenv("GEMINI_API_KEY"):
 # -----------------------------
 # JSON Helpers
 # -----------------------------
+_json_cache = {}  # path -> (mtime, parsed data)
+
 def load_json(path: str):
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        # Re-parse only when the file actually changed on disk
+        mtime = os.stat(path).st_mtime
+        cached = _json_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if ORJSON_AVAILABLE:
+            with open(path, "rb") as f:
+                data = orjson.loads(f.read())
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        _json_cache[path] = (mtime, data)
+        return data
     except Exception:
         return [] if path == MEMORY_FILE else {}
 
 def save_json(path: str, data):
+    # Compact output (no indent) — pretty-printing a 1000-entry memory list
+    # per request costs serialization time and ~30% extra bytes on disk
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        if ORJSON_AVAILABLE:
+            with open(path, "wb") as f:
+                f.write(orjson.dumps(data))
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"), ensure_ascii=False)
+        try:
+            _json_cache[path] = (os.stat(path).st_mtime, data)
+        except Exception:
+            _json_cache.pop(path, None)
     except Exception as e:
         print(f"[DEBUG] Save JSON failed: {e}")
 
+async def asave_json(path: str, data):
+    """Async save_json — keeps the event loop free during disk writes."""
+    if not AIOFILES_AVAILABLE:
+        return save_json(path, data)
+    try:
+        if ORJSON_AVAILABLE:
+            async with aiofiles.open(path, "wb") as f:
+                await f.write(orjson.dumps(data))
+        else:
+            async with aiofiles.open(path, "w", encoding="utf-8") as f:
+                await f.write(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+        try:
+            _json_cache[path] = (os.stat(path).st_mtime, data)
+        except Exception:
+            _json_cache.pop(path, None)
+    except Exception as e:
+        print(f"[DEBUG] Save JSON failed: {e}")
+
+# -----------------------------
+# Append-only memory log (JSONL)
+# -----------------------------
+_mem_appends = 0
+_mem_cache = None  # (mtime, entries) — skip re-reading the log when unchanged
+
+def load_memory():
+    """Read the memory log — one JSON entry per line, bad lines skipped."""
+    global _mem_cache
+    entries = []
+    try:
+        mtime = os.stat(MEMORY_FILE).st_mtime
+        if _mem_cache is not None and _mem_cache[0] == mtime:
+            return _mem_cache[1]
+        with open(MEMORY_FILE, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(orjson.loads(line) if ORJSON_AVAILABLE else json.loads(line))
+                except Exception:
+                    continue
+        _mem_cache = (mtime, entries)
+    except Exception as e:
+        print(f"[DEBUG] Memory load error: {e}")
+    return entries
+
+def _mem_line(entry):
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(entry) + b"\n"
+    return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+def _note_append(entry):
+    """Shared post-append bookkeeping: cache upkeep and rotation."""
+    global _mem_appends, _mem_cache
+    # Keep the in-process cache current instead of forcing a re-read
+    try:
+        if _mem_cache is not None:
+            _mem_cache[1].append(entry)
+            _mem_cache = (os.stat(MEMORY_FILE).st_mtime, _mem_cache[1])
+    except Exception:
+        _mem_cache = None
+    _mem_appends += 1
+    if _mem_appends >= 500:
+        rotate_memory()
+        _mem_appends = 0
+
+def append_memory(entry):
+    """O(1) append of one turn — no full-file rewrite per request."""
+    with open(MEMORY_FILE, "ab") as f:
+        f.write(_mem_line(entry))
+    _note_append(entry)
+
+async def aappend_memory(entry):
+    """Async append_memory — the event loop isn't blocked on the write."""
+    if not AIOFILES_AVAILABLE:
+        return append_memory(entry)
+    async with aiofiles.open(MEMORY_FILE, "ab") as f:
+        await f.write(_mem_line(entry))
+    _note_append(entry)
+
+def rotate_memory(max_entries=1000):
+    """Trim the log to its last max_entries lines."""
+    global _mem_cache
+    try:
+        with open(MEMORY_FILE, "rb") as f:
+            lines = deque(f, maxlen=max_entries)
+        with open(MEMORY_FILE, "wb") as f:
+            f.writelines(lines)
+        _mem_cache = None
+    except Exception as e:
+        print(f"[DEBUG] Memory rotation error: {e}")
+
+rotate_memory()  # One trim at startup keeps the log bounded between runs
+
 # -----------------------------
 # Enhanced Semantic Memory Retrieval (RAG Core)
 # -----------------------------
-def retrieve_semantic_context(query: str, top_k=3, max_history=5):
+def retrieve_semantic_context(query: str, top_k=3, max_history=5, query_vec=None):
     """
     RAG Implementation: Embed query, retrieve top-k similar past Q&A chunks,
     then build a chained context summary for generation.
+    Pass query_vec to reuse an embedding already computed this request.
     """
     try:
-        mem = load_json(MEMORY_FILE)
+        q = (query or "").strip()
+        # Greeting/ack turns gain nothing from retrieval — skip it outright
+        if q.lower() in {"hi", "hello", "hey", "thanks", "thank you"}:
+            return ""
+
+        mem = load_memory()
         if not mem:
             return ""
-        
-        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+
+        # Trivial cases: too few entries to rank, or too short a query to
+        # embed meaningfully — stringify the most recent entries directly
+        if len(mem) <= top_k * 2 or len(q.split()) < 3:
+            return "From past learning:\n" + "\n---\n".join(
+                f"Q: {m.get('query', '')}\nA: {m.get('answer', '')[:200]}" for m in mem[-top_k:]
+            )
+
+        if not EMBEDDINGS_AVAILABLE:
             # Fallback: Recent history only
             recent = mem[-top_k:]
             chunks = [f"Past: Q: {m.get('query','')}\nA: {m.get('answer','')[:200]}..." for m in recent]
             return "\n".join(chunks)
         
-        query_vec = embed_text(query)
-        scored_chunks = []
-        
-        # Sample recent memory to avoid OOM on large files (increased for better coverage)
-        sample_mem = random.sample(mem[-500:], min(100, len(mem[-500:])))  # Sample up to 100 recent
-        
-        for m in sample_mem:
-            # Embed the full Q&A as a "chunk" for better relevance (improved: average Q and A vecs)
-            q_text = m.get("query", "")
-            a_text = m.get("answer", "")[:200]  # Truncate long answers
+        if query_vec is None:  # Reuse the semantic-cache embedding when given
+            query_vec = encode_batch([query])[0]
+        top_chunks = []
+
+        if HNSW_AVAILABLE and EMBED_CACHE_AVAILABLE:
+            # ANN over ALL memory entries — no sampling, no recall loss
             try:
-                q_vec = embed_text(q_text)
-                a_vec = embed_text(a_text)
-                chunk_vec = (q_vec + a_vec) / 2  # Average for richer similarity
-                sim = util.pytorch_cos_sim(query_vec, chunk_vec).item()
-                if sim > 0.2:  # Threshold to filter low-relevance
-                    chunk_text = f"Q: {q_text}\nA: {a_text}"
-                    scored_chunks.append((sim, chunk_text))
-                    print(f"[DEBUG] Sim score: {sim:.3f} for chunk: {q_text[:30]}...")  # Debug log
+                index, entries = _get_hnsw_index(mem)
+                if entries:
+                    labels, dists = index.knn_query(
+                        np.asarray(query_vec, dtype=np.float32).reshape(1, -1),
+                        k=min(top_k, len(entries)),
+                    )
+                    for label, dist in zip(labels[0], dists[0]):
+                        sim = 1.0 - float(dist)  # Cosine space returns distances
+                        if sim > SIM_THRESHOLD:
+                            m = entries[int(label)]
+                            top_chunks.append(f"Q: {m.get('query', '')}\nA: {m.get('answer', '')[:200]}")
+                            print(f"[DEBUG] Sim score: {sim:.3f} for chunk: {m.get('query', '')[:30]}...")  # Debug log
             except Exception as e:
-                print(f"[DEBUG] Embedding chunk error: {e}")
-        
-        # Top-k similar chunks
-        top_chunks = sorted(scored_chunks, key=lambda x: x[0], reverse=True)[:top_k]
-        
+                print(f"[DEBUG] HNSW retrieval error: {e}")
+        else:
+            # Fallback: sample recent memory to bound work, then flat search.
+            # Draw indices into the tail window instead of materializing a
+            # 500-entry slice for random.sample — one np.random call, no copy
+            window = min(len(mem), 500)
+            n_sample = min(100, window)
+            if NUMPY_AVAILABLE:
+                idx = np.random.choice(window, size=n_sample, replace=False)
+                offset = len(mem) - window
+                sample_mem = [mem[offset + int(i)] for i in idx]
+            else:
+                sample_mem = random.sample(mem[-window:], n_sample)
+
+            try:
+                if EMBED_CACHE_AVAILABLE:
+                    # Persistent cache: cached entries are sliced from disk-backed
+                    # vectors, only unseen entries pay an encode forward pass.
+                    chunk_vecs = get_embed_cache().get_or_embed(sample_mem, encode_batch)
+                else:
+                    # Batch-embed all Q&A chunks in ONE encode call instead of 2
+                    # forward passes per entry (SBERT smart-batching).
+                    texts = []
+                    for m in sample_mem:
+                        texts.append(m.get("query", ""))
+                        texts.append(m.get("answer", "")[:200])  # Truncate long answers
+                    vecs = encode_batch(texts)
+                    chunk_vecs = (vecs[0::2] + vecs[1::2]) / 2  # Average Q and A vecs
+
+                # Normalize so inner product == cosine sim
+                qn = np.ascontiguousarray(
+                    (query_vec / (np.linalg.norm(query_vec) + 1e-9)).reshape(1, -1), dtype=np.float32
+                )
+                cn = np.ascontiguousarray(
+                    chunk_vecs / (np.linalg.norm(chunk_vecs, axis=1, keepdims=True) + 1e-9),
+                    dtype=np.float32,
+                )
+                k = min(top_k, len(sample_mem))
+                if FAISS_AVAILABLE:
+                    # One C++ BLAS call returns top-k directly — no per-item
+                    # Python scoring and no final Python sort
+                    index = faiss.IndexFlatIP(cn.shape[1])
+                    index.add(cn)
+                    D, I = index.search(qn, k)
+                    hits = [(float(D[0][j]), int(I[0][j])) for j in range(k) if D[0][j] > SIM_THRESHOLD]
+                else:
+                    sims = (cn @ qn[0])
+                    order = np.argsort(sims)[::-1][:k]
+                    hits = [(float(sims[i]), int(i)) for i in order if sims[i] > SIM_THRESHOLD]
+                for sim, i in hits:
+                    m = sample_mem[i]
+                    top_chunks.append(f"Q: {m.get('query', '')}\nA: {m.get('answer', '')[:200]}")
+                    print(f"[DEBUG] Sim score: {sim:.3f} for chunk: {m.get('query', '')[:30]}...")  # Debug log
+            except Exception as e:
+                print(f"[DEBUG] Batch embedding error: {e}")
+
         # Chain into a coherent context (e.g., "From past chats: [chunk1] [chunk2]")
-        rag_context = "From past learning:\n" + "\n---\n".join([chunk for _, chunk in top_chunks])
+        rag_context = "From past learning:\n" + "\n---\n".join(top_chunks)
         
         # Add recent history for multi-turn feel (last max_history entries)
         recent_history = mem[-max_history:]
@@ -216,7 +608,11 @@ def build_conversation_context(user_id: str, query: str, rag_context: str, profi
     Context Answering: Weave RAG + profile + style into a prompt-ready string.
     Makes responses feel learned/personalized without dumping raw data.
     """
-    topics = ", ".join([k for k, v in sorted(profile.get("topics", {}).items(), key=lambda x: x[1], reverse=True)[:3]])
+    # Precomputed by update_user_profile — no per-request sort of all topics
+    top3 = profile.get("_top3")
+    if top3 is None:
+        top3 = [k for k, _ in heapq.nlargest(3, profile.get("topics", {}).items(), key=lambda x: x[1])]
+    topics = ", ".join(top3)
     style_prompt = f"Respond in a {profile.get('style', 'friendly')} tone, tying into user's interests: {topics}."
     
     # Improved: Summarize if too long
@@ -238,46 +634,96 @@ Use this to answer thoughtfully, building on what we've discussed before. ALWAYS
 # -----------------------------
 # New: Fine-Tuning Data Logger
 # -----------------------------
-def log_for_fine_tuning(user_id: str, query: str, context: str, answer: str):
+_ft_count = None  # Running entry count — avoids re-reading the whole file per request
+
+async def log_for_fine_tuning(user_id: str, query: str, context: str, answer: str):
     """
     Log Q&A in Alpaca format for fine-tuning (e.g., with Hugging Face TRL).
     """
+    global _ft_count
     try:
         entry = {
             "instruction": "You are an AI mentor for students learning AI & programming. Explain step-by-step.",
             "input": context,
             "output": answer
         }
-        with open(FINE_TUNE_FILE, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-        print(f"[DEBUG] Logged for fine-tuning: {len(open(FINE_TUNE_FILE).readlines())} entries")
+        if ORJSON_AVAILABLE:
+            line = orjson.dumps(entry).decode() + "\n"
+        else:
+            line = json.dumps(entry, ensure_ascii=False) + "\n"
+        if _ft_count is None:
+            # Count existing lines once per process, then just increment
+            try:
+                with open(FINE_TUNE_FILE, "r", encoding="utf-8") as f:
+                    _ft_count = sum(1 for _ in f)
+            except Exception:
+                _ft_count = 0
+        if AIOFILES_AVAILABLE:
+            # Non-blocking append so the event loop stays free
+            async with aiofiles.open(FINE_TUNE_FILE, "a", encoding="utf-8") as f:
+                await f.write(line)
+        else:
+            with open(FINE_TUNE_FILE, "a", encoding="utf-8") as f:
+                f.write(line)
+        _ft_count += 1
+        print(f"[DEBUG] Logged for fine-tuning: {_ft_count} entries")
     except Exception as e:
         print(f"[DEBUG] Fine-tune logging error: {e}")
 
 # -----------------------------
 # Updated Graph (Optional, Simplified for Learning)
 # -----------------------------
-# Remove old graph usage. New: Use graph for topic clustering (not direct retrieval)
-def update_learning_graph(query: str):
+# Graph and profile updates happen on in-memory counters and are flushed to
+# disk every FLUSH_EVERY requests (plus on shutdown) — keeps synchronous
+# load+sort+save disk I/O out of the /chat critical path.
+FLUSH_EVERY = 50
+
+_graph_counter = None  # lazily loaded Counter over graph.json
+_graph_dirty = 0
+_profiles = None  # lazily loaded user_profile.json contents
+_profiles_dirty = 0
+
+def _get_graph_counter():
+    global _graph_counter
+    if _graph_counter is None:
+        graph = load_json(GRAPH_FILE)
+        _graph_counter = Counter(graph if isinstance(graph, dict) else {})
+    return _graph_counter
+
+def _graph_top50():
+    # O(n log 50) instead of a full sort of the topic dict
+    return dict(heapq.nlargest(50, _graph_counter.items(), key=lambda x: x[1]))
+
+def _flush_graph():
+    if _graph_counter is not None:
+        save_json(GRAPH_FILE, _graph_top50())
+
+def _flush_graph_nowait():
+    """Mid-request flush: hand the write to asave_json so the loop stays free."""
+    if _graph_counter is None:
+        return
+    try:
+        asyncio.get_running_loop().create_task(asave_json(GRAPH_FILE, _graph_top50()))
+    except RuntimeError:  # No running loop (scripts/tests) — write synchronously
+        save_json(GRAPH_FILE, _graph_top50())
+
+def update_learning_graph(q_lower_tokens):
     """
     Simplified: Track topics for future RAG filtering, not direct word dumps.
     Improved: Better topic extraction (words >3 chars).
+    Takes the pre-lowered token list computed once per request.
     """
+    global _graph_dirty
     try:
-        graph = load_json(GRAPH_FILE)
-        if not isinstance(graph, dict):
-            graph = {}
-        
         # Extract key topics: longer words for better clustering
-        key_topic = ' '.join([w for w in query.lower().split() if len(w) > 3])[:20].strip()
+        key_topic = ' '.join([w for w in q_lower_tokens if len(w) > 3])[:20].strip()
         if not key_topic:
             key_topic = "misc"
-        graph.setdefault(key_topic, 0)
-        graph[key_topic] += 1
-        
-        # Prune to top 50 topics
-        top_topics = dict(sorted(graph.items(), key=lambda x: x[1], reverse=True)[:50])
-        save_json(GRAPH_FILE, top_topics)
+        _get_graph_counter()[key_topic] += 1
+        _graph_dirty += 1
+        if _graph_dirty >= FLUSH_EVERY:
+            _flush_graph_nowait()
+            _graph_dirty = 0
         print(f"[DEBUG] Graph updated for topic: {key_topic}")  # Debug log
     except Exception as e:
         print(f"[DEBUG] Graph update error: {e}")
@@ -285,31 +731,79 @@ def update_learning_graph(query: str):
 # -----------------------------
 # User Personalization
 # -----------------------------
-def update_user_profile(user_id, query):
-    try:
+def _get_profiles():
+    global _profiles
+    if _profiles is None:
         profile = load_json(USER_PROFILE_FILE)
+        _profiles = profile if isinstance(profile, dict) else {}
+    return _profiles
+
+def _flush_profiles():
+    if _profiles is not None:
+        save_json(USER_PROFILE_FILE, _profiles)
+
+def _flush_profiles_nowait():
+    """Mid-request flush: hand the write to asave_json so the loop stays free."""
+    if _profiles is None:
+        return
+    try:
+        asyncio.get_running_loop().create_task(asave_json(USER_PROFILE_FILE, _profiles))
+    except RuntimeError:  # No running loop (scripts/tests) — write synchronously
+        save_json(USER_PROFILE_FILE, _profiles)
+
+def update_user_profile(user_id, q_tokens):
+    global _profiles_dirty
+    try:
+        profile = _get_profiles()
         if user_id is None:
             user_id = "default_user"
         if user_id not in profile:
             profile[user_id] = {"topics": {}, "style": "friendly"}
-        for word in query.split():
-            profile[user_id]["topics"][word] = profile[user_id]["topics"].get(word, 0) + 1
-        save_json(USER_PROFILE_FILE, profile)
+        topics = profile[user_id]["topics"]
+        for word in q_tokens:
+            topics[word] = topics.get(word, 0) + 1
+        # Maintain the top-3 topics here so request time never sorts the
+        # (unbounded) topics dict; re-rank only when a bumped word could
+        # actually displace the current top-3
+        top3 = profile[user_id].get("_top3", [])
+        floor = min((topics.get(k, 0) for k in top3), default=0)
+        if len(top3) < 3 or any(w in top3 or topics[w] >= floor for w in q_tokens):
+            profile[user_id]["_top3"] = [
+                k for k, _ in heapq.nlargest(3, topics.items(), key=lambda x: x[1])
+            ]
+        _profiles_dirty += 1
+        if _profiles_dirty >= FLUSH_EVERY:
+            _flush_profiles_nowait()
+            _profiles_dirty = 0
     except Exception as e:
         print(f"[DEBUG] update_user_profile error: {e}")
 
 def get_user_profile(user_id):
     try:
-        profile = load_json(USER_PROFILE_FILE)
-        return profile.get(user_id, {"style": "friendly", "topics": {}})
+        return _get_profiles().get(user_id, {"style": "friendly", "topics": {}})
     except Exception:
         return {"style": "friendly", "topics": {}}
 
+@app.on_event("shutdown")
+async def flush_state():
+    # Persist any counts still buffered in memory
+    try:
+        _flush_graph()
+        _flush_profiles()
+    except Exception as e:
+        print(f"[DEBUG] Shutdown flush error: {e}")
+    # And any embedding vectors not yet batch-flushed
+    try:
+        if EMBED_CACHE_AVAILABLE and get_embed_cache.cache_info().currsize:
+            get_embed_cache().flush()
+    except Exception as e:
+        print(f"[DEBUG] Shutdown embed cache flush error: {e}")
+
 # -----------------------------
 # Tool Handling
 # -----------------------------
-def choose_tool(query):
-    q = (query or "").lower()
+def choose_tool(q_lower):
+    q = q_lower or ""
     if "search" in q or "latest" in q:
         return "web_search"
     elif "code" in q or "run" in q:
@@ -372,6 +866,26 @@ class ChatRequest(BaseModel):
     query: str
     user_id: str | None = "default_user"
 
+# -----------------------------
+# Startup warm-up
+# -----------------------------
+@app.on_event("startup")
+async def warm_embeddings():
+    # Load the model, run one warmup encode and pre-build retrieval state so
+    # the first /chat doesn't pay the cold-start latency inside the request
+    if not EMBEDDINGS_AVAILABLE:
+        return
+    try:
+        get_embed_model()
+        encode_batch(["warmup"])
+        if EMBED_CACHE_AVAILABLE:
+            get_embed_cache()
+            if HNSW_AVAILABLE:
+                _get_hnsw_index(load_memory())
+        print("[DEBUG] Embedding warmup complete.")
+    except Exception as e:
+        print(f"[DEBUG] Startup warmup failed: {e}")
+
 # -----------------------------
 # Health
 # -----------------------------
@@ -389,11 +903,29 @@ async def chat(req: ChatRequest):
         user_query = (req.query or "").strip()
         print(f"[DEBUG] New query: {user_query}")
 
+        # Lower/split once — profile, graph and tool routing all reuse these
+        q_lower = user_query.lower()
+        q_tokens = user_query.split()
+        q_lower_tokens = q_lower.split()
+
         # Personalization
-        update_user_profile(req.user_id, user_query)
+        update_user_profile(req.user_id, q_tokens)
         profile = get_user_profile(req.user_id)
         style = profile.get("style", "friendly")
 
+        # Semantic response cache: a near-duplicate recent query returns the
+        # cached response directly, skipping planning, RAG, LLM and reflection
+        query_vec = None
+        if SEMANTIC_CACHE_AVAILABLE and EMBEDDINGS_AVAILABLE:
+            try:
+                query_vec = encode_batch([user_query])[0]
+                cached = get_semantic_cache().get(query_vec, threshold=0.95)
+                if cached is not None:
+                    print(f"[DEBUG] Served from semantic cache in {time.time()-start_time:.3f}s")
+                    return cached
+            except Exception as e:
+                print(f"[DEBUG] Semantic cache lookup error: {e}")
+
         # Planning (keep as-is)
         try:
             plan = plan_and_execute(user_query)
@@ -403,7 +935,7 @@ async def chat(req: ChatRequest):
 
         # Enhanced RAG Context
         try:
-            rag_context = retrieve_semantic_context(user_query, top_k=3, max_history=5)
+            rag_context = retrieve_semantic_context(user_query, top_k=3, max_history=5, query_vec=query_vec)
         except Exception as e:
             print(f"[DEBUG] RAG error: {e}")
             rag_context = ""
@@ -412,7 +944,7 @@ async def chat(req: ChatRequest):
         full_context = build_conversation_context(req.user_id, user_query, rag_context, profile)
 
         # Tool (keep as-is)
-        tool_name = choose_tool(user_query)
+        tool_name = choose_tool(q_lower)
         try:
             tool_result = execute_tool(tool_name, user_query)
         except Exception as e:
@@ -445,31 +977,35 @@ async def chat(req: ChatRequest):
             print(f"[DEBUG] Reflection error: {e}")
             reflection = "[Reflection failed]"
 
-        # Save Memory (keep as-is)
+        # Cache the new entry's embedding so future retrievals skip re-embedding it
+        if EMBED_CACHE_AVAILABLE and EMBEDDINGS_AVAILABLE:
+            try:
+                get_embed_cache().add_entry(user_query, answer, encode_batch)
+            except Exception as e:
+                print(f"[DEBUG] Embed cache append error: {e}")
+
+        # Update Graph (in-memory counter)
+        update_learning_graph(q_lower_tokens)
+
+        # Save Memory & Log for Fine-Tuning — both appends run concurrently
+        # off the event loop instead of serializing on disk
         try:
-            mem = load_json(MEMORY_FILE)
-            if not isinstance(mem, list):
-                mem = []
-            mem.append({
-                "user_id": req.user_id,
-                "query": user_query,
-                "answer": answer,
-                "plan": plan,
-                "reflection": reflection,
-                "ts": time.time()
-            })
-            if len(mem) > 1000:
-                mem = mem[-1000:]
-            save_json(MEMORY_FILE, mem)
+            await asyncio.gather(
+                aappend_memory({
+                    "user_id": req.user_id,
+                    "query": user_query,
+                    "answer": answer,
+                    "plan": plan,
+                    "reflection": reflection,
+                    "ts": time.time()
+                }),
+                log_for_fine_tuning(req.user_id, user_query, full_context, answer),
+            )
         except Exception as e:
             print(f"[DEBUG] Memory save error: {e}")
 
-        # Update Graph & Log for Fine-Tuning
-        update_learning_graph(user_query)
-        log_for_fine_tuning(req.user_id, user_query, full_context, answer)
-
         print(f"[DEBUG] Completed in {time.time()-start_time:.2f}s")
-        return {
+        response = {
             "answer": answer,
             "reflection": reflection,
             "plan": plan,
@@ -481,6 +1017,15 @@ async def chat(req: ChatRequest):
             },
         }
 
+        # Store in the semantic cache so near-duplicate follow-ups are instant
+        if query_vec is not None:
+            try:
+                get_semantic_cache().put(query_vec, response)
+            except Exception as e:
+                print(f"[DEBUG] Semantic cache store error: {e}")
+
+        return response
+
     except Exception as e:
         print(f"[DEBUG] Outer error: {e}")
         return {"error": str(e)}
\ No newline at end of file
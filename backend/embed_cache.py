@@ -0,0 +1,185 @@
+import os
+import json
+import hashlib
+
+# -----------------------------
+# Optional numpy (always present when sentence_transformers is installed)
+# -----------------------------
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception as e:
+    print(f"[DEBUG] numpy not available: {e}")
+    NUMPY_AVAILABLE = False
+
+# -----------------------------
+# File paths
+# -----------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBED_IDS_FILE = os.path.join(BASE_DIR, "embeds_ids.json")
+EMBED_VECS_FILE = os.path.join(BASE_DIR, "embeds.npz")
+LEGACY_VECS_FILE = os.path.join(BASE_DIR, "embeds.npy")  # Pre-quantization float32 store
+
+EMBED_DIM = 384  # all-MiniLM-L6-v2 output size
+FLUSH_EVERY = 50  # Persist after this many new vectors, not per append
+
+
+def entry_id(query: str, answer: str) -> str:
+    """Stable id for a memory entry — blake2b hash of its Q&A chunk text."""
+    raw = f"{query or ''}\n{(answer or '')[:200]}".encode("utf-8", errors="ignore")
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def quantize(vecs):
+    """
+    Scalar int8 quantization with per-vector (alpha, v_min):
+    cuts the bytes scanned per retrieval 4x vs float32 with negligible
+    recall loss. Values map to [0, 255] so the codes are stored as uint8.
+    """
+    vecs = np.asarray(vecs, dtype=np.float32)
+    v_min = vecs.min(axis=1)
+    v_max = vecs.max(axis=1)
+    alpha = np.maximum(v_max - v_min, 1e-9) / 255.0
+    q = np.round((vecs - v_min[:, None]) / alpha[:, None]).astype(np.uint8)
+    return q, alpha.astype(np.float32), v_min.astype(np.float32)
+
+
+def dequantize(q, alpha, v_min):
+    """Recover approximate float32 vectors from int8 codes."""
+    return q.astype(np.float32) * alpha[:, None] + v_min[:, None]
+
+
+class EmbedCache:
+    """
+    Persistent embedding cache for memory Q&A chunks.
+    Avoids re-embedding the same historical entries on every /chat call:
+    int8-quantized embeddings are stored on disk (embeds.npz + embeds_ids.json)
+    and only new memory entries pay an encode forward pass.
+
+    Storage is a fixed-capacity ring: arrays are preallocated once and the
+    oldest row is overwritten when full, so appends never reallocate and
+    the cache stays bounded alongside the rotated memory log.
+    """
+
+    def __init__(self, dim: int = EMBED_DIM, cap: int = 2048):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy not installed")
+        self.dim = dim
+        self.cap = cap
+        self.ids: list = [None] * cap
+        self.q = np.zeros((cap, dim), dtype=np.uint8)
+        self.alpha = np.zeros(cap, dtype=np.float32)
+        self.v_min = np.zeros(cap, dtype=np.float32)
+        self.n = 0  # valid rows
+        self._head = 0  # next write slot
+        self._pos = {}  # id -> row index
+        self._dirty = 0  # new vectors since the last flush
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(EMBED_IDS_FILE):
+                with open(EMBED_IDS_FILE, "r", encoding="utf-8") as f:
+                    ids = json.load(f)
+            else:
+                return
+            if os.path.exists(EMBED_VECS_FILE):
+                data = np.load(EMBED_VECS_FILE)
+                q, alpha, v_min = data["q"], data["alpha"], data["v_min"]
+            elif os.path.exists(LEGACY_VECS_FILE):
+                # Migrate the old float32 store in place
+                q, alpha, v_min = quantize(np.load(LEGACY_VECS_FILE))
+            else:
+                return
+            if q.shape != (len(ids), self.dim):
+                print("[DEBUG] Embed cache shape mismatch, starting fresh")
+                return
+            if len(ids) > self.cap:  # Keep only the newest rows
+                ids, q, alpha, v_min = ids[-self.cap:], q[-self.cap:], alpha[-self.cap:], v_min[-self.cap:]
+            n = len(ids)
+            self.ids[:n] = ids
+            self.q[:n], self.alpha[:n], self.v_min[:n] = q, alpha, v_min
+            self.n = n
+            self._head = n % self.cap
+            self._pos = {eid: i for i, eid in enumerate(ids)}
+            print(f"[DEBUG] Embed cache loaded: {n} vectors (int8)")
+        except Exception as e:
+            print(f"[DEBUG] Embed cache load failed: {e}")
+
+    def flush(self):
+        try:
+            np.savez(
+                EMBED_VECS_FILE,
+                q=self.q[:self.n], alpha=self.alpha[:self.n], v_min=self.v_min[:self.n],
+            )
+            with open(EMBED_IDS_FILE, "w", encoding="utf-8") as f:
+                json.dump(self.ids[:self.n], f)
+            self._dirty = 0
+        except Exception as e:
+            print(f"[DEBUG] Embed cache flush failed: {e}")
+
+    def _maybe_flush(self):
+        # Rewriting the whole store per new answer would put an O(cap) disk
+        # write back on the request path; batch it like the graph/profile
+        # flushes (anything unflushed is re-embeddable from the memory log)
+        if self._dirty >= FLUSH_EVERY:
+            self.flush()
+
+    def _add(self, eid: str, vec):
+        if eid in self._pos:
+            return
+        row = self._head
+        old = self.ids[row]
+        if old is not None:
+            self._pos.pop(old, None)  # Ring overwrite evicts the oldest entry
+        q, alpha, v_min = quantize(vec.reshape(1, -1))
+        self.q[row], self.alpha[row], self.v_min[row] = q[0], alpha[0], v_min[0]
+        self.ids[row] = eid
+        self._pos[eid] = row
+        self._head = (self._head + 1) % self.cap
+        self.n = min(self.n + 1, self.cap)
+        self._dirty += 1
+
+    def add_entry(self, query: str, answer: str, encode_fn):
+        """Embed and cache one new Q&A entry (called on memory append)."""
+        eid = entry_id(query, answer)
+        if eid in self._pos:
+            return
+        vecs = np.asarray(encode_fn([query or "", (answer or "")[:200]]), dtype=np.float32)
+        self._add(eid, (vecs[0] + vecs[1]) / 2)
+        self._maybe_flush()
+
+    def get_or_embed(self, entries, encode_fn):
+        """
+        Return a (N, dim) float32 matrix of chunk vectors for memory entries.
+        Cached rows are dequantized from the int8 store; only cache misses
+        are batch-embedded (and persisted for next time).
+        """
+        ids = [entry_id(m.get("query", ""), m.get("answer", "")) for m in entries]
+        out = np.zeros((len(entries), self.dim), dtype=np.float32)
+        hit_out_idx = []
+        hit_rows = []
+        miss_idx = []
+        miss_texts = []
+        for i, eid in enumerate(ids):
+            row = self._pos.get(eid)
+            if row is not None:
+                hit_out_idx.append(i)
+                hit_rows.append(row)
+            else:
+                miss_idx.append(i)
+                m = entries[i]
+                miss_texts.append(m.get("query", ""))
+                miss_texts.append(m.get("answer", "")[:200])
+        if hit_rows:
+            rows = np.asarray(hit_rows)
+            out[hit_out_idx] = dequantize(self.q[rows], self.alpha[rows], self.v_min[rows])
+        if miss_idx:
+            vecs = np.asarray(encode_fn(miss_texts), dtype=np.float32)
+            avg = (vecs[0::2] + vecs[1::2]) / 2
+            for j, i in enumerate(miss_idx):
+                out[i] = avg[j]
+                self._add(ids[i], avg[j])
+            self._maybe_flush()
+            print(f"[DEBUG] Embed cache: {len(hit_rows)} hits, {len(miss_idx)} new")
+        return out
@@ -1,3 +1,10 @@
+import re
+
+# Pre-built DFA for the fixed context-reference check — ek hi scan, multiple
+# Python substring checks ki jagah
+_CTX_RE = re.compile(r'\b(past|earlier|previously|before)\b')
+
+
 def reflect_answer(answer: str, query: str, ctx: str) -> str:
     """
     Reflects on the answer: Checks for clarity, relevance, and suggests improvements.
@@ -10,14 +17,16 @@ def reflect_answer(answer: str, query: str, ctx: str) -> str:
     query_lower = query.lower()
     answer_lower = answer.lower()
     
-    # Relevance check: Query ke key words answer mein hain?
-    if any(word in answer_lower for word in query_lower.split()[:3]):
+    # Relevance check: Query ke key words answer mein hain? (single regex scan)
+    q_words = query_lower.split()[:3]
+    q_re = re.compile("|".join(map(re.escape, q_words))) if q_words else None
+    if q_re is not None and q_re.search(answer_lower):
         relevance = "✅ High relevance"
     else:
         relevance = "⚠️ Low relevance—query ke main points miss ho gaye."
-    
+
     # Context usage
-    if len(ctx) > 0 and any("past" in answer_lower or "earlier" in answer_lower):
+    if len(ctx) > 0 and _CTX_RE.search(answer_lower):
         context_use = "✅ Good use of past context!"
     else:
         context_use = "💡 Suggestion: Agli baar past learning ko reference karo."
@@ -0,0 +1,83 @@
+import time
+
+# -----------------------------
+# Optional numpy (always present when sentence_transformers is installed)
+# -----------------------------
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception as e:
+    print(f"[DEBUG] numpy not available: {e}")
+    NUMPY_AVAILABLE = False
+
+
+class SemanticCache:
+    """
+    LSH-based query -> response cache for /chat.
+    Near-duplicate queries (very common in student tutoring) hit a cached
+    response and skip the whole plan + RAG + LLM + reflection pipeline.
+    Keyed by the query EMBEDDING, not a text hash, so paraphrases match:
+    8 random-projection hash tables x 12 bits bucket the vectors, and
+    candidates in matching buckets are verified with exact cosine sim.
+    """
+
+    def __init__(self, dim: int = 384, n_tables: int = 8, n_bits: int = 12, ttl: float = 300.0):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy not installed")
+        rng = np.random.default_rng(42)  # Fixed seed: stable buckets across restarts
+        self.planes = rng.standard_normal((n_tables, n_bits, dim)).astype(np.float32)
+        self._pows = (2 ** np.arange(n_bits)).astype(np.int64)
+        self.tables = [{} for _ in range(n_tables)]  # bucket key -> [entry idx]
+        self.entries = []  # (normalized vec, response, timestamp)
+        self.ttl = ttl
+
+    def _bucket_keys(self, vec):
+        bits = (self.planes @ vec) > 0  # (n_tables, n_bits)
+        return (bits @ self._pows).tolist()
+
+    @staticmethod
+    def _normalize(vec):
+        vec = np.asarray(vec, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) + 1e-9)
+
+    def get(self, query_vec, threshold: float = 0.95):
+        """Return the cached response for a near-duplicate query, or None."""
+        vn = self._normalize(query_vec)
+        now = time.time()
+        candidates = set()
+        for t, key in enumerate(self._bucket_keys(vn)):
+            candidates.update(self.tables[t].get(key, ()))
+        best_sim, best_resp = 0.0, None
+        for idx in candidates:
+            vec, resp, ts = self.entries[idx]
+            if now - ts > self.ttl:
+                continue
+            sim = float(vec @ vn)
+            if sim >= threshold and sim > best_sim:
+                best_sim, best_resp = sim, resp
+        if best_resp is not None:
+            print(f"[DEBUG] Semantic cache hit (sim={best_sim:.3f})")
+        return best_resp
+
+    def _evict_expired(self):
+        # Drop dead entries and rebuild the buckets — without this the
+        # entries list and every bucket grow without bound, each retaining
+        # a full response dict long after its TTL has passed
+        now = time.time()
+        live = [e for e in self.entries if now - e[2] <= self.ttl]
+        if len(live) == len(self.entries):
+            return
+        self.entries = live
+        self.tables = [{} for _ in self.tables]
+        for idx, (vec, _, _) in enumerate(self.entries):
+            for t, key in enumerate(self._bucket_keys(vec)):
+                self.tables[t].setdefault(key, []).append(idx)
+
+    def put(self, query_vec, response):
+        """Store a fresh response under the query's LSH buckets."""
+        self._evict_expired()
+        vn = self._normalize(query_vec)
+        idx = len(self.entries)
+        self.entries.append((vn, response, time.time()))
+        for t, key in enumerate(self._bucket_keys(vn)):
+            self.tables[t].setdefault(key, []).append(idx)